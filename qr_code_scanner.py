@@ -4,16 +4,24 @@
 # Created: 2025-06-23
 
 import os
+import atexit
 import cv2
 import time
-import sys
 import argparse
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
 import numpy as np
-from typing import Optional
+from typing import Callable, Optional
 from pathlib import Path
-import csv
-from io import StringIO
+
+try:
+    from pyzbar.pyzbar import decode as zbar_decode, ZBarSymbol
+
+    _ZBAR_SYMBOLS = [ZBarSymbol.QRCODE]
+except ImportError:  # pyzbar or the zbar shared library is not installed
+    zbar_decode = None
+    _ZBAR_SYMBOLS = None
 
 
 cv2.setUseOptimized(True)  # Enable OpenCV optimizations, improves real time performance
@@ -21,6 +29,32 @@ cv2.ocl.setUseOpenCL(
     False
 )  # Disable OpenCL, rely on CPU for processing for better compatibility
 
+DEFAULT_FRAME_WIDTH = 640  # Requested capture resolution, plenty for QR detection
+DEFAULT_FRAME_HEIGHT = 480
+DEFAULT_FPS = 30
+MAX_DETECT_WIDTH = 720  # Frames wider than this are downscaled before QR detection
+
+# Preprocessing retried when a QR code is detected but cannot be decoded.
+# Each entry is (transform, scale), scale maps the detected corner points onto the transformed image.
+_DECODE_RETRIES = (
+    (lambda gray: _invert(gray), 1),
+    (lambda gray: _get_clahe().apply(gray), 1),
+    (lambda gray: cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)[1], 1),
+    (lambda gray: cv2.resize(gray, None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC), 2),
+)
+
+# OpenCV releases the GIL while decoding, so the retries above run concurrently on a shared pool
+_RETRY_POOL = ThreadPoolExecutor(
+    max_workers=min(len(_DECODE_RETRIES), os.cpu_count() or 2), thread_name_prefix="qr-retry"
+)
+
+_THREAD_STATE = threading.local()  # Per-thread OpenCV objects and scratch buffers, none are thread-safe
+
+LOG_BUFFER_SIZE = 1 << 16  # Bytes buffered in memory per open log file
+LOG_FLUSH_INTERVAL = 1.0  # Seconds after which the next log write also flushes the buffer
+LOG_FLUSH_EVERY = 128  # Buffered log messages that trigger a flush
+_LOG_WRITERS: dict[Path, "_LogWriter"] = {}  # Open log files, reused across write_log_to_file calls
+_LOG_LOCK = threading.Lock()
 
 
 def main() -> None:
@@ -37,6 +71,18 @@ def main() -> None:
         default=10,
         help="Timeout in seconds for QR code detection. Default is 10 seconds.",
     )
+    parser.add_argument(
+        "--width",
+        type=int,
+        default=DEFAULT_FRAME_WIDTH,
+        help=f"Requested camera frame width. Default is {DEFAULT_FRAME_WIDTH} pixels.",
+    )
+    parser.add_argument(
+        "--height",
+        type=int,
+        default=DEFAULT_FRAME_HEIGHT,
+        help=f"Requested camera frame height. Default is {DEFAULT_FRAME_HEIGHT} pixels.",
+    )
     args = parser.parse_args()
 
     if args.output:
@@ -49,7 +95,16 @@ def main() -> None:
         args.timeout = 10
     print(f"Timeout set to: {args.timeout} seconds")
 
-    qr_data = read_qr_code_from_camera(timeout_duration = args.timeout)
+    if args.width <= 0 or args.height <= 0:
+        print(
+            f"Frame size must be positive. Using default of {DEFAULT_FRAME_WIDTH}x{DEFAULT_FRAME_HEIGHT}."
+        )
+        args.width, args.height = DEFAULT_FRAME_WIDTH, DEFAULT_FRAME_HEIGHT
+    print(f"Frame size set to: {args.width}x{args.height}")
+
+    qr_data = read_qr_code_from_camera(
+        timeout_duration=args.timeout, width=args.width, height=args.height
+    )
     
     print("QR code data:", qr_data if qr_data else "None")
 
@@ -71,84 +126,400 @@ def main() -> None:
     return
 
 
-def get_camera_image(
-    filename: Optional[str] = None, camera_index: int = 0
-) -> Optional[np.ndarray]:
-    """Captures an image from the camera and optionally saves it to a file."""
+def open_camera(
+    camera_index: int = 0,
+    width: int = DEFAULT_FRAME_WIDTH,
+    height: int = DEFAULT_FRAME_HEIGHT,
+) -> Optional[cv2.VideoCapture]:
+    """Opens the camera once so it can be reused across captures, with a 1-frame driver buffer."""
 
     cap = cv2.VideoCapture(camera_index, cv2.CAP_AVFOUNDATION)
     if not cap.isOpened():
         print("Could not open camera")
+        cap.release()
+        return None
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # Keep only the newest frame in the driver buffer
+    cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+    cap.set(cv2.CAP_PROP_FPS, DEFAULT_FPS)
+    actual_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    actual_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    if (actual_width, actual_height) != (width, height):
+        # Some backends silently ignore the requested resolution
+        print(f"Camera resolution is {actual_width}x{actual_height}, requested {width}x{height}")
+    return cap
+
+
+def capture_frame(
+    cap: cv2.VideoCapture, filename: Optional[str] = None
+) -> Optional[np.ndarray]:
+    """Captures a frame from an already open camera and optionally saves it to a file."""
+
+    if not cap.grab():
+        print("Failed to capture image from camera")
         return None
-    ret, frame = cap.read()
+    ret, frame = cap.retrieve()
     if not ret:
         print("Failed to capture image from camera")
-        cap.release()
         return None
-    cap.release()
     if filename:
         cv2.imwrite(filename, frame)
         print(f"Image saved to {filename}")
     return frame
 
 
-def parse_qr_code(image: np.ndarray) -> Optional[list[str]]:
-    """Parses a QR code from the provided image and returns its data as a list of strings."""
+def get_camera_image(
+    filename: Optional[str] = None,
+    camera_index: int = 0,
+    width: int = DEFAULT_FRAME_WIDTH,
+    height: int = DEFAULT_FRAME_HEIGHT,
+) -> Optional[np.ndarray]:
+    """Captures an image from the camera and optionally saves it to a file."""
+
+    cap = open_camera(camera_index, width, height)
+    if cap is None:
+        return None
+    try:
+        return capture_frame(cap, filename)
+    finally:
+        cap.release()
+
+
+def _get_qr_detector() -> cv2.QRCodeDetector:
+    """Returns the calling thread's QRCodeDetector, creating it on first use."""
+
+    detector = getattr(_THREAD_STATE, "detector", None)
+    if detector is None:
+        detector = _THREAD_STATE.detector = cv2.QRCodeDetector()
+    return detector
+
+
+def _get_clahe() -> cv2.CLAHE:
+    """Returns the calling thread's CLAHE contrast enhancer, creating it on first use."""
+
+    clahe = getattr(_THREAD_STATE, "clahe", None)
+    if clahe is None:
+        clahe = _THREAD_STATE.clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+    return clahe
+
+
+def _invert(gray: np.ndarray) -> np.ndarray:
+    """Inverts a grayscale image into a per-thread buffer that is reused across frames."""
+
+    inverted = getattr(_THREAD_STATE, "inverted", None)
+    if inverted is None or inverted.shape != gray.shape:
+        inverted = _THREAD_STATE.inverted = np.empty_like(gray)
+    return cv2.bitwise_not(gray, dst=inverted)
+
+
+def _prepare_for_detection(image: np.ndarray) -> np.ndarray:
+    """Converts an image to grayscale and downscales it to at most MAX_DETECT_WIDTH pixels wide."""
+
+    gray = image
+    if image.ndim == 3:
+        gray = getattr(_THREAD_STATE, "gray", None)
+        if gray is None or gray.shape != image.shape[:2]:
+            gray = _THREAD_STATE.gray = np.empty(image.shape[:2], dtype=np.uint8)
+        cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=gray)  # Reuse the per-thread buffer
+    scale = MAX_DETECT_WIDTH / gray.shape[1]
+    if scale < 1:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return gray
+
+
+def _decode_detected(
+    qr_decoder: cv2.QRCodeDetector, gray: np.ndarray, points: np.ndarray, multi: bool
+) -> list[str]:
+    """Decodes the QR codes at the detected corner points, returning only non-empty results.
+
+    Without multi, codes are decoded one at a time and the first one that decodes is returned.
+    """
 
-    qr_decoder = cv2.QRCodeDetector()
+    if multi:
+        retval, data, _ = qr_decoder.decodeMulti(gray, points)
+        return [d for d in data if d] if retval else []
+    for i in range(len(points)):
+        data, _ = qr_decoder.decode(gray, points[i : i + 1])
+        if data:
+            return [data]  # Skip decoding the remaining codes
+    return []
+
+
+def _decode_variant(
+    transform: Callable[[np.ndarray], np.ndarray],
+    scale: float,
+    gray: np.ndarray,
+    points: np.ndarray,
+    multi: bool,
+    stop: threading.Event,
+) -> list[str]:
+    """Decodes detected QR codes on one preprocessed copy of the image, run on a retry pool thread."""
+
+    if stop.is_set():
+        return []  # Another variant already succeeded
+    return _decode_detected(_get_qr_detector(), transform(gray), points * scale, multi)
+
+
+def _retry_decode(gray: np.ndarray, points: np.ndarray, multi: bool) -> list[str]:
+    """Retries decoding detected QR codes on preprocessed copies of the image in parallel, returning the first success."""
+
+    # Retries that lose the race keep running after we return, so they get a private copy
+    # instead of the caller's per-thread buffer, which the next frame overwrites in place
+    snapshot = gray.copy()
+    stop = threading.Event()
+    pending = {
+        _RETRY_POOL.submit(_decode_variant, transform, scale, snapshot, points, multi, stop)
+        for transform, scale in _DECODE_RETRIES
+    }
     try:
-        retval, data, points, _ = qr_decoder.detectAndDecodeMulti(image)
-        if retval and data:
-            return [d for d in data if d]
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                decoded = future.result()
+                if decoded:
+                    return decoded
+    finally:
+        stop.set()  # Variants that have not begun decoding skip their work
+        for future in pending:
+            future.cancel()
+    return []
+
+
+def parse_qr_code(
+    image: np.ndarray, use_zbar: bool = True, multi: bool = False
+) -> Optional[list[str]]:
+    """Parses a QR code from the provided image and returns its data as a list of strings.
+
+    Uses pyzbar when use_zbar is set and it is available, otherwise OpenCV's QRCodeDetector.
+    Only the first QR code found is returned unless multi is set.
+    """
+
+    gray = _prepare_for_detection(image)
+    if use_zbar and zbar_decode is not None:
+        symbols = zbar_decode(gray, symbols=_ZBAR_SYMBOLS)
+        decoded = [s.data.decode("utf-8", errors="replace") for s in symbols if s.data]
+        return (decoded if multi else decoded[:1]) or None
+    qr_decoder = _get_qr_detector()
+    try:
+        # Single-code detect() fails on frames with several codes, so always detect them all
+        found, points = qr_decoder.detectMulti(gray)
+        if not found:
+            return None  # Most frames have no QR code, skip the expensive decode step
+        decoded = _decode_detected(qr_decoder, gray, points, multi)
+        if not decoded:
+            decoded = _retry_decode(gray, points, multi)
+        return decoded or None
     except ValueError as e:
         print(f"Error decoding QR code: {e}")
     return None
 
 
-def read_qr_code_from_camera(poll_interval: float = 0.2, timeout_duration: float = 10) -> Optional[str]:
-    """Reads a QR code from the camera, polling at specified intervals until a QR code is detected or timeout occurs."""
+class _CameraWorker(threading.Thread):
+    """Background thread that keeps reading frames from an open camera into a 1-slot latest-frame buffer.
+
+    The worker owns the capture and releases it when it exits, so the camera is never
+    released while a read() is still in progress.
+    """
+
+    def __init__(self, cap: cv2.VideoCapture) -> None:
+        super().__init__(daemon=True)
+        self._cap = cap
+        self._lock = threading.Lock()
+        self._latest: Optional[np.ndarray] = None
+        self._spare_frames: list[np.ndarray] = []  # Buffers the camera can read into instead of allocating
+        self._new_frame = threading.Event()
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        try:
+            while not self._stop_event.is_set():
+                with self._lock:
+                    buffer = self._spare_frames.pop() if self._spare_frames else None
+                ret, frame = self._cap.read(buffer)  # Fills buffer in place when its shape matches
+                if not ret:
+                    if buffer is not None:
+                        self.recycle(buffer)
+                    self._stop_event.wait(0.01)  # Back off briefly instead of spinning on a failing camera
+                    continue
+                with self._lock:
+                    if self._latest is not None:
+                        self._spare_frames.append(self._latest)  # Older frame was never decoded, reuse it
+                    self._latest = frame
+                self._new_frame.set()  # Wake up the consumer as soon as a frame is available
+        finally:
+            self._cap.release()  # Only the reading thread releases, never mid-read
+
+    def pop_latest(self) -> Optional[np.ndarray]:
+        """Returns the newest captured frame and empties the slot, or None if no new frame arrived."""
+
+        with self._lock:
+            frame, self._latest = self._latest, None
+        return frame
+
+    def recycle(self, frame: np.ndarray) -> None:
+        """Hands a frame the caller no longer needs back to the worker to read into."""
+
+        with self._lock:
+            self._spare_frames.append(frame)
+
+    def wait_for_frame(self, timeout: float) -> Optional[np.ndarray]:
+        """Blocks until a new frame is captured or timeout elapses, then returns the newest frame."""
+
+        if not self._new_frame.wait(timeout):
+            return None
+        self._new_frame.clear()
+        return self.pop_latest()
+
+    def stop(self) -> None:
+        """Signals the thread to stop and waits briefly for it to exit.
+
+        A read() that is still blocked keeps running; the thread releases the camera once it returns.
+        """
+
+        self._stop_event.set()
+        self.join(timeout=1)
+
 
-    start_time = time.time()
-    while time.time() - start_time < timeout_duration:
-        frame = get_camera_image()  # Capture frame using get_camera_image
-        if frame is None:
-            print("No image captured.")
-            continue
-        qr_data = parse_qr_code(frame)
-        if qr_data:
-            return qr_data[0]  # Return the first QR code detected
-        time.sleep(poll_interval)
+def read_qr_code_from_camera(
+    *,  # Keyword-only, so calls written for the old leading poll_interval fail loudly
+    timeout_duration: float = 10,
+    width: int = DEFAULT_FRAME_WIDTH,
+    height: int = DEFAULT_FRAME_HEIGHT,
+) -> Optional[str]:
+    """Reads a QR code from the camera, decoding each new frame until a QR code is detected or timeout occurs.
+
+    Frames are captured on a background thread so camera I/O overlaps with decoding, and
+    the loop sleeps until a new frame arrives or the timeout expires.
+
+    The loop is intentionally GUI-free. If a preview window is ever added, poll it with
+    cv2.pollKey(), which returns immediately, rather than cv2.waitKey(1), which can block
+    for ~15 ms per call and caps the scan rate.
+    """
+
+    cap = open_camera(width=width, height=height)
+    if cap is None:
+        return None
+    worker = _CameraWorker(cap)
+    worker.start()
+    try:
+        deadline = time.monotonic() + timeout_duration  # Monotonic, unaffected by wall clock changes
+        while (remaining := deadline - time.monotonic()) > 0:
+            frame = worker.wait_for_frame(remaining)
+            if frame is None:
+                continue
+            qr_data = parse_qr_code(frame)
+            if qr_data:
+                return qr_data[0]  # Return the first QR code detected
+            worker.recycle(frame)
+    finally:
+        worker.stop()  # The worker releases the camera after its last read
     print("No QR code detected within the timeout period.")
     return None
 
 
+def _csv_escape(value: str) -> str:
+    """Quotes a CSV field the same way csv.writer does, only when it needs it."""
+
+    if "," in value or '"' in value or "\n" in value or "\r" in value:
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+
+class _LogWriter:
+    """Keeps a CSV log file open with a large write buffer so repeated log writes avoid reopening it."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._open()
+        self.last_flush = time.monotonic()
+        # Pending rows are kept as parallel columns and written out together in one batch
+        self.timestamps: list[str] = []
+        self.messages: list[str] = []
+
+    def _open(self) -> None:
+        self.file = open(self.path, "a", newline="", buffering=LOG_BUFFER_SIZE)
+        if self.file.tell() == 0:  # Append mode starts at the end, no extra stat() needed
+            # Written right away so another scanner opening the same log sees it is not empty
+            self.file.write("Timestamp,Message\r\n")
+            self.file.flush()
+
+    def _reopen_if_rotated(self) -> None:
+        """Reopens the log if it was deleted or replaced since it was opened, so rows are not lost."""
+
+        try:
+            current = os.stat(self.path)
+        except FileNotFoundError:
+            current = None
+        opened = os.fstat(self.file.fileno())
+        if current is None or (current.st_dev, current.st_ino) != (opened.st_dev, opened.st_ino):
+            self.file.close()
+            self._open()
+
+    def write(self, message: str) -> None:
+        self.timestamps.append(datetime.now().isoformat(sep=" ", timespec="seconds"))
+        self.messages.append(message)
+        if (
+            len(self.messages) >= LOG_FLUSH_EVERY
+            or time.monotonic() - self.last_flush >= LOG_FLUSH_INTERVAL
+        ):
+            self.flush()
+
+    def flush(self) -> None:
+        if self.messages:
+            self._reopen_if_rotated()  # Checked once per batch, not per message
+            self.file.write(
+                "".join(
+                    f"{timestamp},{_csv_escape(message)}\r\n"
+                    for timestamp, message in zip(self.timestamps, self.messages)
+                )
+            )
+            self.timestamps.clear()
+            self.messages.clear()
+        self.file.flush()
+        self.last_flush = time.monotonic()
+
+
 def write_log_to_file(filename: str | Path, message: str) -> None:
-    """Writes a log message to a specified CSV file with a timestamp."""
+    """Writes a log message to a specified CSV file with a timestamp.
+
+    Messages are buffered and written to disk in one batch every LOG_FLUSH_EVERY messages,
+    on the first write after LOG_FLUSH_INTERVAL seconds, by flush_logs(), or when the
+    program exits. There is no timer, so a lone message stays buffered until one of those.
+    """
 
     if not filename:
         print("No filename provided for logging.")
         return
     path = Path(filename)
-    if path.parent != Path("."):
-        path.parent.mkdir(parents=True, exist_ok=True)
-    try:
-        with open(path, "a", newline="") as f:
-            writer = csv.writer(f)
-            if path.stat().st_size == 0:
-                writer.writerow(["Timestamp", "Message"])
-            writer.writerow([datetime.now().strftime("%Y-%m-%d %H:%M:%S"), message])
-    except IOError as e:
-        print(f"Error writing to log file: {e}")
-
-
-def capture_stdout_and_stderr() -> tuple[StringIO, StringIO]:
-    """Captures stdout and stderr to StringIO buffers for testing purposes."""
-
-    stdout_buffer = StringIO()
-    stderr_buffer = StringIO()
-    sys.stdout = stdout_buffer
-    sys.stderr = stderr_buffer
-    return stdout_buffer, stderr_buffer
+    key = path.resolve()  # Different spellings of the same file share one writer
+    with _LOG_LOCK:
+        log_writer = _LOG_WRITERS.get(key)
+        if log_writer is None:
+            if path.parent != Path("."):
+                path.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                log_writer = _LOG_WRITERS[key] = _LogWriter(key)
+            except IOError as e:
+                print(f"Error writing to log file: {e}")
+                return
+        try:
+            log_writer.write(message)
+        except IOError as e:
+            print(f"Error writing to log file: {e}")
+
+
+def flush_logs() -> None:
+    """Writes all buffered log messages to disk."""
+
+    with _LOG_LOCK:
+        for log_writer in _LOG_WRITERS.values():
+            try:
+                log_writer.flush()
+            except IOError as e:
+                print(f"Error writing to log file: {e}")
+
+
+atexit.register(flush_logs)
 
 
 if __name__ == "__main__":
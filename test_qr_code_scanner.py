@@ -12,10 +12,21 @@ import sys
 from contextlib import redirect_stdout, redirect_stderr
 from io import StringIO
 import csv
+import threading
+import time
 from qr_code_scanner import (
+    _CameraWorker,
+    _decode_variant,
+    _get_clahe,
+    _get_qr_detector,
+    _invert,
+    _retry_decode,
+    capture_frame,
     get_camera_image,
+    open_camera,
     parse_qr_code,
     write_log_to_file,
+    flush_logs,
     read_qr_code_from_camera,
 )
 
@@ -82,6 +93,132 @@ def test_parse_qr_code_correct_data(qr_test_image):
     assert data in qr_data, f"QR code data does not match expected: {data}"
 
 
+def test_parse_qr_code_large_image(qr_test_image):
+    """Test if parse_qr_code decodes a QR code from a frame larger than the detection width."""
+    data, image = qr_test_image
+    large = cv2.resize(image, None, fx=6, fy=6, interpolation=cv2.INTER_NEAREST)
+    qr_data = parse_qr_code(large)
+    assert qr_data is not None and data in qr_data, "parse_qr_code failed on a large image."
+
+
+def test_parse_qr_code_grayscale(qr_test_image):
+    """Test if parse_qr_code accepts single-channel images."""
+    data, image = qr_test_image
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    qr_data = parse_qr_code(gray)
+    assert qr_data is not None and data in qr_data, "parse_qr_code failed on a grayscale image."
+
+
+def test_parse_qr_code_opencv_fallback(qr_test_image):
+    """Test if parse_qr_code decodes with OpenCV when zbar is disabled."""
+    data, image = qr_test_image
+    qr_data = parse_qr_code(image, use_zbar=False)
+    assert qr_data is not None and data in qr_data, "OpenCV decoding failed."
+
+
+def test_parse_qr_code_multi(qr_test_image):
+    """Test if parse_qr_code decodes every QR code when multi is set."""
+    data, image = qr_test_image
+    pair = np.hstack([image, image])
+    qr_data = parse_qr_code(pair, use_zbar=False, multi=True)
+    assert qr_data == [data, data], "parse_qr_code should return both QR codes."
+    assert parse_qr_code(pair, use_zbar=False) == [data], "Default should return one QR code."
+
+
+def test_parse_qr_code_skips_undecodable_code(qr_test_image):
+    """Test if parse_qr_code returns a decodable code when another detected code is damaged."""
+    data, image = qr_test_image
+    damaged = image.copy()
+    h, w = damaged.shape[:2]
+    rng = np.random.default_rng(0)
+    noise = (rng.random((h // 25 + 1, w // 25 + 1)) > 0.5).astype(np.uint8) * 255
+    noise = np.kron(noise, np.ones((10, 10), dtype=np.uint8))
+    # Scramble the data area while keeping the finder patterns detectable
+    y0, y1, x0, x1 = int(h * 0.4), int(h * 0.8), int(w * 0.4), int(w * 0.8)
+    damaged[y0:y1, x0:x1] = noise[: y1 - y0, : x1 - x0, None]
+    for pair in (np.hstack([damaged, image]), np.hstack([image, damaged])):
+        qr_data = parse_qr_code(pair, use_zbar=False)
+        assert qr_data == [data], "parse_qr_code should return the decodable QR code."
+
+
+def test_parse_qr_code_skips_decode_without_detection(mocker):
+    """Test if parse_qr_code skips decoding when no QR code is detected."""
+    decode = mocker.patch.object(cv2.QRCodeDetector, "decode")
+    qr_data = parse_qr_code(np.zeros((300, 300, 3), dtype=np.uint8), use_zbar=False)
+    assert qr_data is None, "parse_qr_code should return None without a QR code."
+    decode.assert_not_called()
+
+
+def test_parse_qr_code_retries_failed_decode(mocker, qr_test_image):
+    """Test if parse_qr_code retries decoding on preprocessed images after a failed decode."""
+    _, image = qr_test_image
+
+    def decode(self, gray, points):
+        # Only the 2x upscaled retry succeeds
+        return ("retry data" if gray.shape[0] > image.shape[0] else "", None)
+
+    mocker.patch.object(cv2.QRCodeDetector, "decode", decode)
+    pool = mocker.patch("qr_code_scanner.ThreadPoolExecutor")
+    qr_data = parse_qr_code(image, use_zbar=False)
+    assert qr_data == ["retry data"], "parse_qr_code should return the retried result."
+    pool.assert_not_called()  # The retry pool is created once at import, not per call
+
+
+def test_retry_decode_uses_private_copy(mocker, qr_test_image):
+    """Test if decode retries work on a copy that callers can overwrite safely."""
+    _, image = qr_test_image
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    seen = []
+
+    def decode(self, variant, points):
+        seen.append(variant)
+        return ("", None)
+
+    mocker.patch.object(cv2.QRCodeDetector, "decode", decode)
+    points = np.array([[[0, 0], [10, 0], [10, 10], [0, 10]]], dtype=np.float32)
+    assert _retry_decode(gray, points, multi=False) == [], "All retries should fail."
+    assert all(
+        not np.shares_memory(variant, gray) for variant in seen
+    ), "Retries should not read the caller's buffer."
+
+
+def test_decode_variant_skips_after_stop(mocker):
+    """Test if a retry variant skips decoding once another variant has succeeded."""
+    stop = threading.Event()
+    stop.set()
+    transform = mocker.MagicMock()
+    gray = np.zeros((10, 10), dtype=np.uint8)
+    points = np.zeros((1, 4, 2), dtype=np.float32)
+    assert _decode_variant(transform, 1, gray, points, False, stop) == []
+    transform.assert_not_called()
+
+
+def test_parse_qr_code_uses_zbar(mocker):
+    """Test if parse_qr_code returns pyzbar results when available."""
+    symbol = mocker.MagicMock(data=b"zbar data")
+    mocker.patch("qr_code_scanner.zbar_decode", return_value=[symbol])
+    qr_data = parse_qr_code(np.zeros((300, 300, 3), dtype=np.uint8))
+    assert qr_data == ["zbar data"], "parse_qr_code should return pyzbar results."
+
+
+def test_qr_detector_is_cached():
+    """Test if the QRCodeDetector is reused across calls in the same thread."""
+    assert _get_qr_detector() is _get_qr_detector(), "QRCodeDetector should be cached."
+
+
+def test_clahe_is_cached():
+    """Test if the CLAHE enhancer used for decode retries is reused across calls."""
+    assert _get_clahe() is _get_clahe(), "CLAHE enhancer should be cached."
+
+
+def test_invert_reuses_buffer():
+    """Test if _invert inverts pixels and reuses its output buffer."""
+    gray = np.array([[0, 100], [200, 255]], dtype=np.uint8)
+    first = _invert(gray)
+    assert np.array_equal(first, 255 - gray), "_invert returned wrong pixels."
+    assert _invert(gray) is first, "_invert should reuse its output buffer."
+
+
 def test_parse_qr_code_no_code():
     """Test if parse_qr_code returns None when no QR code is present."""
     image = np.zeros((300, 300, 3), dtype=np.uint8)
@@ -99,11 +236,165 @@ def test_read_qr_code_from_camera(mocker):
     ), "read_qr_code_from_camera did not return expected QR code data."
 
 
+def test_read_qr_code_from_camera_reuses_camera(mocker):
+    """Test that read_qr_code_from_camera opens the camera once and releases it."""
+    cap = mocker.MagicMock()
+    cap.read.return_value = (True, np.zeros((10, 10, 3), dtype=np.uint8))
+    open_camera = mocker.patch("qr_code_scanner.open_camera", return_value=cap)
+    mocker.patch(
+        "qr_code_scanner.parse_qr_code", side_effect=[None, None, ["test QR code data"]]
+    )
+    result = read_qr_code_from_camera(timeout_duration=1)
+    assert result == "test QR code data", "Unexpected QR code data returned."
+    open_camera.assert_called_once()
+    cap.release.assert_called_once()
+
+
+def test_camera_worker_does_not_release_during_read(mocker):
+    """Test if a read() blocking past the stop timeout finishes before the camera is released."""
+    reading = threading.Event()
+    finish_read = threading.Event()
+    released_during_read = []
+
+    def read(image=None):
+        reading.set()
+        finish_read.wait(5)
+        released_during_read.append(cap.release.called)
+        return False, None
+
+    cap = mocker.MagicMock()
+    cap.read.side_effect = read
+    worker = _CameraWorker(cap)
+    worker.start()
+    reading.wait(1)
+    worker.stop()  # Times out while read() is still blocked
+    assert worker.is_alive(), "Worker should still be inside read()."
+    cap.release.assert_not_called()
+    finish_read.set()
+    worker.join(timeout=1)
+    assert released_during_read == [False], "Camera was released while read() was running."
+    cap.release.assert_called_once()
+
+
+def test_camera_worker_keeps_latest_frame(mocker):
+    """Test if _CameraWorker exposes captured frames and stops cleanly."""
+    cap = mocker.MagicMock()
+    cap.read.return_value = (True, np.zeros((10, 10, 3), dtype=np.uint8))
+    worker = _CameraWorker(cap)
+    worker.start()
+    frame = worker.wait_for_frame(timeout=1)
+    worker.stop()
+    assert frame is not None, "_CameraWorker did not capture a frame."
+    assert not worker.is_alive(), "_CameraWorker did not stop."
+
+
+def test_camera_worker_reuses_recycled_frames(mocker):
+    """Test if _CameraWorker reads into frames handed back with recycle."""
+    buffers = []
+
+    def read(image=None):
+        buffers.append(image)
+        return True, image if image is not None else np.zeros((10, 10, 3), dtype=np.uint8)
+
+    cap = mocker.MagicMock()
+    cap.read.side_effect = read
+    worker = _CameraWorker(cap)
+    worker.start()
+    frame = worker.wait_for_frame(timeout=1)
+    worker.recycle(frame)
+    for _ in range(100):
+        if any(b is frame for b in buffers):
+            break
+        time.sleep(0.01)
+    worker.stop()
+    assert any(b is frame for b in buffers), "_CameraWorker did not reuse the recycled frame."
+
+
+def test_camera_worker_wait_for_frame_timeout(mocker):
+    """Test if _CameraWorker.wait_for_frame returns None when no frame arrives."""
+    cap = mocker.MagicMock()
+    cap.read.return_value = (False, None)
+    worker = _CameraWorker(cap)
+    worker.start()
+    frame = worker.wait_for_frame(timeout=0.05)
+    worker.stop()
+    assert frame is None, "wait_for_frame should return None on timeout."
+
+
+def test_read_qr_code_from_camera_timeout(mocker):
+    """Test if read_qr_code_from_camera returns None once the timeout expires."""
+    cap = mocker.MagicMock()
+    cap.read.return_value = (False, None)
+    mocker.patch("qr_code_scanner.open_camera", return_value=cap)
+    start = time.monotonic()
+    result = read_qr_code_from_camera(timeout_duration=0.3)
+    elapsed = time.monotonic() - start
+    assert result is None, "read_qr_code_from_camera should return None on timeout."
+    assert elapsed < 1.5, "read_qr_code_from_camera did not respect the timeout."
+
+
+def test_open_camera_requests_resolution(mocker):
+    """Test if open_camera requests the configured frame size."""
+    cap = mocker.MagicMock()
+    cap.isOpened.return_value = True
+    cap.get.side_effect = lambda prop: {
+        cv2.CAP_PROP_FRAME_WIDTH: 800,
+        cv2.CAP_PROP_FRAME_HEIGHT: 600,
+    }.get(prop, 0)
+    mocker.patch("qr_code_scanner.cv2.VideoCapture", return_value=cap)
+    assert open_camera(width=800, height=600) is cap, "open_camera should return the capture."
+    cap.set.assert_any_call(cv2.CAP_PROP_FRAME_WIDTH, 800)
+    cap.set.assert_any_call(cv2.CAP_PROP_FRAME_HEIGHT, 600)
+
+
+def test_read_qr_code_from_camera_waits_without_spinning(mocker):
+    """Test if read_qr_code_from_camera blocks instead of spinning when no frames arrive."""
+    cap = mocker.MagicMock()
+    cap.read.return_value = (False, None)
+    mocker.patch("qr_code_scanner.open_camera", return_value=cap)
+    wait = mocker.spy(_CameraWorker, "wait_for_frame")
+    read_qr_code_from_camera(timeout_duration=0.3)
+    assert wait.call_count <= 2, f"Scan loop woke up {wait.call_count} times without frames."
+
+
+def test_read_qr_code_from_camera_rejects_positional_arguments():
+    """Test if old positional calls with poll_interval first raise instead of shifting meaning."""
+    with pytest.raises(TypeError):
+        read_qr_code_from_camera(0.2, 10)
+
+
+def test_read_qr_code_from_camera_poll_rate(mocker):
+    """Test if the scan loop is not throttled, e.g. by a blocking cv2.waitKey call."""
+    frame = np.zeros((10, 10, 3), dtype=np.uint8)
+
+    def read(image=None):
+        time.sleep(0.002)  # Simulate a 500 fps camera that releases the GIL while waiting
+        return True, frame
+
+    cap = mocker.MagicMock()
+    cap.read.side_effect = read
+    mocker.patch("qr_code_scanner.open_camera", return_value=cap)
+    parse = mocker.patch("qr_code_scanner.parse_qr_code", return_value=None)
+    read_qr_code_from_camera(timeout_duration=1)
+    # cv2.waitKey(1) costs ~15 ms, which would cap the loop well below this
+    assert (
+        parse.call_count >= 100
+    ), f"Scan loop only decoded {parse.call_count} frames in 1 second."
+
+
+def test_capture_frame_failure(mocker):
+    """Test if capture_frame returns None when the camera cannot grab a frame."""
+    cap = mocker.MagicMock()
+    cap.grab.return_value = False
+    assert capture_frame(cap) is None, "capture_frame should return None on failure."
+
+
 def test_write_log_to_file():
     """Test if write_log_to_file creates a CSV log file with the correct content."""
     log_file = Path("test_log.csv")
     message = "This is a test log message."
     write_log_to_file(log_file, message)
+    flush_logs()
     assert log_file.exists(), "Log file was not created."
     with open(log_file, "r") as f:
         reader = csv.reader(f)
@@ -117,6 +408,7 @@ def test_write_log_to_file_no_message():
     """Test if write_log_to_file handles empty messages."""
     log_file = Path("test_log_empty.csv")
     write_log_to_file(log_file, "")
+    flush_logs()
     assert log_file.exists(), "Log file was not created."
     with open(log_file, "r") as f:
         reader = csv.reader(f)
@@ -126,6 +418,95 @@ def test_write_log_to_file_no_message():
     log_file.unlink()
 
 
+def test_write_log_to_file_appends_buffered_messages():
+    """Test if repeated write_log_to_file calls append to the same log with one header."""
+    log_file = Path("test_log_buffered.csv")
+    for i in range(3):
+        write_log_to_file(log_file, f"message {i}")
+    flush_logs()
+    with open(log_file, "r") as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ["Timestamp", "Message"], "Log file should start with a header."
+    assert [row[1] for row in rows[1:]] == ["message 0", "message 1", "message 2"]
+    log_file.unlink()
+
+
+def test_write_log_to_file_existing_log():
+    """Test if write_log_to_file does not repeat the header for an existing log file."""
+    log_file = Path("test_log_existing.csv")
+    log_file.write_text("Timestamp,Message\r\n2025-01-01 00:00:00,old message\r\n")
+    write_log_to_file(log_file, "new message")
+    flush_logs()
+    with open(log_file, "r") as f:
+        rows = list(csv.reader(f))
+    assert len(rows) == 3, "Log file should have one header and two messages."
+    assert rows[2][1] == "new message", "Log file should contain the new message."
+    log_file.unlink()
+
+
+def test_write_log_to_file_escapes_message():
+    """Test if write_log_to_file quotes messages containing CSV special characters."""
+    log_file = Path("test_log_escaped.csv")
+    message = 'QR code detected: "a,b"\nnext line'
+    write_log_to_file(log_file, message)
+    flush_logs()
+    with open(log_file, "r", newline="") as f:
+        rows = list(csv.reader(f))
+    assert rows[1][1] == message, "Log file should round-trip special characters."
+    log_file.unlink()
+
+
+def test_write_log_to_file_flushes_full_batch(mocker):
+    """Test if write_log_to_file writes a batch to disk once enough messages are buffered."""
+    mocker.patch("qr_code_scanner.LOG_FLUSH_EVERY", 2)
+    mocker.patch("qr_code_scanner.LOG_FLUSH_INTERVAL", 60)
+    log_file = Path("test_log_batch.csv")
+    write_log_to_file(log_file, "first")
+    assert log_file.read_text() == "Timestamp,Message\n", "A partial batch should stay buffered."
+    write_log_to_file(log_file, "second")
+    with open(log_file, "r") as f:
+        rows = list(csv.reader(f))
+    assert [row[1] for row in rows] == ["Message", "first", "second"]
+    log_file.unlink()
+
+
+def test_write_log_to_file_same_file_different_spelling():
+    """Test if relative and absolute paths to one log share a single header."""
+    log_file = Path("test_log_spelling.csv")
+    write_log_to_file(log_file, "relative")
+    write_log_to_file(log_file.resolve(), "absolute")
+    flush_logs()
+    with open(log_file, "r") as f:
+        rows = list(csv.reader(f))
+    assert [row[1] for row in rows] == ["Message", "relative", "absolute"]
+    log_file.unlink()
+
+
+def test_write_log_to_file_after_log_deleted():
+    """Test if write_log_to_file recreates a log that was deleted while cached."""
+    log_file = Path("test_log_rotated.csv")
+    write_log_to_file(log_file, "before")
+    flush_logs()
+    log_file.unlink()
+    write_log_to_file(log_file, "after")
+    flush_logs()
+    with open(log_file, "r") as f:
+        rows = list(csv.reader(f))
+    assert [row[1] for row in rows] == ["Message", "after"], "Rows were lost after rotation."
+    log_file.unlink()
+
+
+def test_write_log_to_file_writes_header_on_open():
+    """Test if a new log gets its header on disk before any message is flushed."""
+    log_file = Path("test_log_header.csv")
+    write_log_to_file(log_file, "buffered")
+    with open(log_file, "r") as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ["Timestamp", "Message"], "Header should be written when the log is opened."
+    flush_logs()
+    log_file.unlink()
+
+
 def test_write_log_to_file_no_filename():
     """Test if write_log_to_file handles no filename gracefully."""
     try: